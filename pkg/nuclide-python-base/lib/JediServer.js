@@ -45,11 +45,15 @@ function getServiceRegistry(): ServiceRegistry {
 export default class JediServer {
   _process: RpcProcess;
 
-  constructor(src: NuclideUri, pythonPath: string = PYTHON_EXECUTABLE) {
+  constructor(
+    src: NuclideUri,
+    pythonPath: string = PYTHON_EXECUTABLE,
+    args: Array<string> = [],
+  ) {
     // Generate a name for this server using the src file name, used to namespace logs
     const name = `JediServer-${nuclideUri.basename(src)}`;
     const createProcess: ProcessMaker
-      = () => safeSpawn(pythonPath, [PROCESS_PATH, '-s', src], OPTS);
+      = () => safeSpawn(pythonPath, [PROCESS_PATH, '-s', src, ...args], OPTS);
     this._process = new RpcProcess(name, getServiceRegistry(), createProcess);
   }
 
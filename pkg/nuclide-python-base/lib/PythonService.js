@@ -104,6 +104,8 @@ export type JediOutlineResult = {
 // Cache the pythonPath on first execution so we don't rerun overrides script
 // everytime.
 let pythonPath;
+// Extra arguments for jediserver.py, also set by the overrides script.
+let jediServerArgs = [];
 async function getPythonPath() {
   if (pythonPath) {
     return pythonPath;
@@ -112,10 +114,18 @@ async function getPythonPath() {
   pythonPath = 'python';
   try {
     // Override the python path if override script is present.
+    // The script may also set `usePyPy`, which passes --pypy to jediserver.py:
+    // the server then re-executes itself under pypy3 (or pypy) if one is on the
+    // PATH, since Jedi runs much faster under PyPy's JIT. When running on
+    // CPython 3.8+, setting PYTHONPYCACHEPREFIX in the environment lets the
+    // server processes share one directory of compiled .pyc files.
     const overrides = await require('./fb/find-jedi-server-args')();
     if (overrides.pythonExecutable) {
       pythonPath = overrides.pythonExecutable;
     }
+    if (overrides.usePyPy) {
+      jediServerArgs = ['--pypy'];
+    }
   } catch (e) {
     // Ignore.
   }
@@ -146,7 +156,7 @@ async function getJediServer(src: NuclideUri): Promise<JediService> {
   let server = jediServers.get(src);
   if (server == null) {
     // Create a JediServer using default python path.
-    server = new JediServer(src, await getPythonPath());
+    server = new JediServer(src, await getPythonPath(), jediServerArgs);
     jediServers.set(src, server);
   }
 
@@ -4,17 +4,48 @@
 # This source code is licensed under the license found in the LICENSE file in
 # the root directory of this source tree.
 
+import atexit
 import getpass
 import hashlib
 import json
 import logging
 import os
+import platform
 import sys
 import tempfile
 import time
-import traceback
+from collections import OrderedDict
 from logging import FileHandler
 from optparse import OptionParser
+try:
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import Queue
+except ImportError:
+    # Python 2 has no queue-based logging handlers; log synchronously.
+    QueueHandler = None
+try:
+    from shutil import which
+except ImportError:
+    # Python 2
+    from distutils.spawn import find_executable as which
+
+
+def exec_with_pypy():
+    # Jedi is pure Python, so its evaluation runs much faster under PyPy's JIT.
+    # Re-run this script with the same arguments (minus --pypy) if PyPy is on
+    # the PATH; otherwise keep going with the current interpreter.
+    for name in ('pypy3', 'pypy'):
+        pypy = which(name)
+        if pypy is not None:
+            args = [arg for arg in sys.argv if arg != '--pypy']
+            os.execv(pypy, [pypy] + args)
+
+
+# Re-exec before importing Jedi, so that work isn't thrown away.
+if (__name__ == '__main__' and '--pypy' in sys.argv and
+        platform.python_implementation() != 'PyPy'):
+    exec_with_pypy()
+
 import jedi
 from jedi.evaluate.representation import InstanceElement
 from jedi.parser.tree import ImportFrom
@@ -23,161 +54,316 @@ import outline
 LOGGING_DIR = 'nuclide-%s-logs/python' % getpass.getuser()
 LIB_DIR = os.path.abspath('../VendorLib')
 WORKING_DIR = os.getcwd()
+# Keep Jedi's pickled parse trees in a directory of our own, so that a
+# differently versioned Jedi installed by the user doesn't invalidate them in
+# its default cache directory. Jedi unpickles files from here, so it must stay
+# in the user's private cache directory (the same one Jedi uses by default),
+# never a shared temp dir.
+if platform.system().lower() == 'windows':
+    JEDI_CACHE_DIR = os.path.join(os.getenv('APPDATA') or '~', 'Nuclide', 'Jedi')
+elif platform.system().lower() == 'darwin':
+    JEDI_CACHE_DIR = os.path.join('~', 'Library', 'Caches', 'Nuclide', 'Jedi')
+else:
+    JEDI_CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME') or '~/.cache',
+                                  'nuclide', 'jedi')
+JEDI_CACHE_DIR = os.path.expanduser(JEDI_CACHE_DIR)
+# Maximum number of Jedi results to keep around for repeated requests.
+RESULT_CACHE_SIZE = 128
+# Results also depend on other modules, which may change on disk, so cached
+# results are only reused for this many seconds (like Jedi's own time caches).
+# JediService-spec.js waits this long out when testing that edits are seen.
+RESULT_CACHE_VALIDITY = 1.0
+# Used to time requests; unlike time.time, time.monotonic isn't affected by
+# system clock adjustments, but it's only available on Python 3.
+get_time = getattr(time, 'monotonic', time.time)
 
 
 class JediServer:
 
-    def __init__(self, src):
+    # Maps each request method to a handler taking (server, request args) and
+    # returning the response result.
+    REQUEST_HANDLERS = {
+        'get_completions': lambda server, data: {
+            'completions': server.get_cached_result(
+                'get_completions', data, server.get_completions),
+        },
+        'get_definitions': lambda server, data: {
+            'definitions': server.get_cached_result(
+                'get_definitions', data, server.get_definitions),
+        },
+        'get_references': lambda server, data: {
+            'references': server.get_cached_result(
+                'get_references', data, server.get_references),
+        },
+        'get_outline': lambda server, data: {
+            'items': outline.get_outline(server.src, data['contents']),
+        },
+    }
+
+    def __init__(self, src, debug=False):
         self.src = src
+        self.debug = debug
         self.sys_path = self.get_filtered_sys_path()
+        # Be consistent with the main Nuclide logs.
+        self.log_path = os.path.join(tempfile.gettempdir(), LOGGING_DIR,
+                                     self.generate_log_name(src))
         self.logger = logging.getLogger()
+        jedi.settings.cache_directory = JEDI_CACHE_DIR
         self.input_stream = sys.stdin
-        self.output_stream = sys.stdout
+        # Responses are written straight to the file descriptor: each one is
+        # already a single string, so the file object's buffering and flush
+        # would only add a copy and an extra call.
+        self.output_fd = sys.stdout.fileno()
+        self.result_cache = OrderedDict()
+        # Digest of the buffer contents the cached results were computed for.
+        self.result_cache_digest = None
+        # (position key, creation time, jedi.api.Script) of the most recently
+        # built script.
+        self.last_script = None
 
     def run(self):
         self.init_logging()
         while True:
             line = self.input_stream.readline()
+            # Requests are newline-delimited JSON (newlines inside the
+            # contents are escaped), so an empty read means stdin was closed.
+            if not line:
+                break
             res = self.process_request(line)
-            json.dump(res, self.output_stream)
+            # Encode the whole response up front so it goes out in a single
+            # write, rather than json.dump writing each chunk separately.
             # Use \n to signal the end of the response.
-            self.output_stream.write('\n')
-            self.output_stream.flush()
+            self.write_response(json.dumps(res) + '\n')
+
+    def write_response(self, response):
+        data = response.encode('utf-8')
+        # os.write may write only part of the data to a full pipe.
+        while data:
+            data = data[os.write(self.output_fd, data):]
 
     def get_filtered_sys_path(self):
         # Retrieves the sys.path with VendorLib filtered out, so symbols from
         # jedi don't appear in user's autocompletions or hyperclicks.
         # Don't filter out VendorLib if we're working in the jediserver's dir. :)
+        # '' is dropped too, since every Jedi Evaluator would remove it from its
+        # copy anyway. This stays a list: Jedi mutates its copy (remove/insert),
+        # which a tuple would not allow.
         return [path for path in sys.path
-                if path != LIB_DIR or self.src.startswith(WORKING_DIR)]
+                if path != '' and
+                (path != LIB_DIR or self.src.startswith(WORKING_DIR))]
 
     def generate_log_name(self, value):
-        hash = hashlib.md5(value).hexdigest()[:10]
+        # The hash is only a fingerprint to keep log names unique per source.
+        # hashlib requires bytes on Python 3.
+        encoded = value if isinstance(value, bytes) else value.encode('utf-8')
+        hash = hashlib.sha1(encoded).hexdigest()[:10]
         return os.path.basename(value) + '-' + hash + '.log'
 
     def init_logging(self):
-        # Be consistent with the main Nuclide logs.
-        log_dir = os.path.join(tempfile.gettempdir(), LOGGING_DIR)
+        log_dir = os.path.dirname(self.log_path)
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
-        handler = FileHandler(os.path.join(log_dir, self.generate_log_name(self.src)))
+        handler = FileHandler(self.log_path)
         handler.setFormatter(logging.Formatter(
             'nuclide-jedi-py %(asctime)s: [%(name)s] %(message)s'
         ))
+        if QueueHandler is not None:
+            # Write log records from a background thread, keeping file I/O
+            # off the request path.
+            queue = Queue()
+            listener = QueueListener(queue, handler)
+            listener.start()
+            atexit.register(listener.stop)
+            handler = QueueHandler(queue)
         self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        self.logger.setLevel(logging.DEBUG if self.debug else logging.INFO)
         self.logger.info('starting for ' + self.src)
 
     def process_request(self, line):
-        start_time = time.time()
+        log_timing = self.logger.isEnabledFor(logging.INFO)
+        if log_timing:
+            start_time = get_time()
 
         req = json.loads(line)
         id, data = req['id'], req['args']
         method = req['method']
-        res = {'type': 'response', 'id': id, 'result': {}}
-
-        try:
-            if method == 'get_completions':
-                res['result']['completions'] = self.get_completions(self.make_script(data))
-            elif method == 'get_definitions':
-                res['result']['definitions'] = self.get_definitions(self.make_script(data))
-            elif method == 'get_references':
-                res['result']['references'] = self.get_references(self.make_script(data))
-            elif method == 'get_outline':
-                res['result']['items'] = outline.get_outline(self.src, data['contents'])
-            else:
-                res['type'] = 'error-response'
-                del res['result']
-                res['error'] = 'Unknown method to jediserver.py: %s.' % method
-        except:
+        res = {'type': 'response', 'id': id}
+
+        handler = JediServer.REQUEST_HANDLERS.get(method)
+        if handler is None:
             res['type'] = 'error-response'
-            del res['result']
-            res['error'] = traceback.format_exc()
+            res['error'] = 'Unknown method to jediserver.py: %s.' % method
+        else:
+            try:
+                res['result'] = handler(self, data)
+            except Exception as e:
+                res['type'] = 'error-response'
+                # Jedi raises constantly on incomplete code while the user is
+                # typing; formatting a full traceback (which walks the stack and
+                # reads source files) is only worth it when debugging.
+                res['error'] = '%s: %s' % (type(e).__name__, e)
+                self.logger.info('Failed %s request: %s', method, res['error'],
+                                 exc_info=self.logger.isEnabledFor(logging.DEBUG))
 
-        self.logger.info('Finished %s request in %.2lf seconds.',
-                         method, time.time() - start_time)
+        if log_timing:
+            self.logger.info('Finished %s request in %.2lf seconds.',
+                             method, get_time() - start_time)
         return res
 
-    def make_script(self, req_data):
-        return jedi.api.Script(
+    def get_cached_result(self, method, req_data, get_result):
+        # Editors resend identical buffers while the cursor moves around, so
+        # briefly reuse the serialized result instead of re-running Jedi.
+        digest = hashlib.sha1(req_data['contents'].encode('utf-8')).digest()
+        # Only results for the current buffer contents are kept.
+        if digest != self.result_cache_digest:
+            self.result_cache.clear()
+            self.result_cache_digest = digest
+        key = (method, req_data['line'], req_data['column'])
+        now = get_time()
+        cached = self.result_cache.pop(key, None)
+        if cached is not None and now - cached[0] < RESULT_CACHE_VALIDITY:
+            # Re-insert as the most recently used entry.
+            self.result_cache[key] = cached
+            return cached[1]
+
+        position_key = (digest, req_data['line'], req_data['column'])
+        result = get_result(self.make_script(req_data, position_key))
+        if len(self.result_cache) >= RESULT_CACHE_SIZE:
+            self.result_cache.popitem(last=False)
+        self.result_cache[key] = (now, result)
+        return result
+
+    def make_script(self, req_data, position_key):
+        # Different requests at the same position in an unchanged buffer (e.g.
+        # a definition lookup followed by find references) share one Script,
+        # along with its parsed module and Jedi's evaluation caches. Those
+        # caches don't notice other modules changing on disk, so the Script is
+        # only reused briefly.
+        now = get_time()
+        if self.last_script is not None:
+            (last_key, created, script) = self.last_script
+            if last_key == position_key and now - created < RESULT_CACHE_VALIDITY:
+                return script
+            # Drop the old Script first so it (and everything Jedi has cached
+            # on it) can be freed while the new one is built.
+            self.last_script = None
+        script = jedi.api.Script(
             source=req_data['contents'], line=req_data['line'] + 1,
             column=req_data['column'], path=self.src,
             sys_path=self.sys_path)
+        self.last_script = (position_key, now, script)
+        return script
 
-    def get_description(self, completion):
-        description = completion.docstring()
+    def get_description(self, completion, docstring, param_descriptions):
+        description = docstring
         # If docstring is not available, attempt to generate a function signature
         # with params.
-        if description == '' and hasattr(completion, 'params'):
+        if description == '' and param_descriptions is not None:
             description = '%s(%s)' % (
                 completion.name,
-                ', '.join(p.description for p in completion.params)
+                ', '.join(param_descriptions)
             )
         return description
 
     def get_completions(self, script):
         results = []
         completions = script.completions()
+        # Don't autocomplete params in the middle of an import from statement.
+        # The user statement is the same for every completion, so check it once.
+        in_import_from = isinstance(script._parser.user_stmt(), ImportFrom)
         for completion in completions:
+            # Completion.params follows the definition on every access and raises
+            # AttributeError if it isn't callable, so only evaluate it once.
+            params = getattr(completion, 'params', None)
+            completion_type = completion.type
+            # If a function has a property decorator, treat it as a property
+            # instead of a method. Settle the type first so each result dict is
+            # built once with its final keys.
+            if completion_type == 'function' and self.is_property(completion):
+                completion_type = 'property'
+            # Return params if completion has params (thus is a class/function).
+            include_params = (params is not None and not in_import_from and
+                              completion_type != 'property')
+            # Param descriptions are inferred lazily by Jedi, so only build them
+            # when they're returned or needed for a missing docstring, and then
+            # only once.
+            docstring = completion.docstring()
+            param_descriptions = None
+            if include_params or (params is not None and docstring == ''):
+                param_descriptions = [p.description for p in params]
             result = {
-                'type': completion.type,
+                'type': completion_type,
                 'text': completion.name,
-                'description': self.get_description(completion),
+                'description': self.get_description(
+                    completion, docstring, param_descriptions),
             }
-            # Return params if completion has params (thus is a class/function).
-            # Don't autocomplete params in the middle of an import from statement.
-            if hasattr(completion, 'params') and not isinstance(
-                    script._parser.user_stmt(), ImportFrom):
-                result['params'] = [p.description for p in completion.params]
-
-            # Check for decorators on functions.
-            if completion.type == 'function' and not completion.in_builtin_module():
-                definition = completion._name.get_definition()
-                if isinstance(definition, InstanceElement):
-                    decorated_func = definition.get_decorated_func()
-                    if decorated_func.decorates is not None:
-                        # If a function has a property decorator, treat it as a property
-                        # instead of a method.
-                        if str(decorated_func.base.name) == 'property':
-                            del result['params']
-                            result['type'] = 'property'
+            if include_params:
+                result['params'] = param_descriptions
             results.append(result)
         return results
 
-    def follow_imports(self, definition):
+    def is_property(self, completion):
+        # Check for decorators on functions.
+        if completion.in_builtin_module():
+            return False
+        definition = completion._name.get_definition()
+        if not isinstance(definition, InstanceElement):
+            return False
+        decorated_func = definition.get_decorated_func()
+        return (decorated_func.decorates is not None and
+                str(decorated_func.base.name) == 'property')
+
+    def follow_imports(self, definition, cache):
         # Iteratively follow a definition until a non-import definition is found.
+        # Results are memoized in cache, since re-exported names often share
+        # the same import chain.
+        key = self.get_position_key(definition)
+        if key in cache:
+            return cache[key]
+
         result = definition
+        visited = set()
         while result.type == 'import':
-            for assignment in definition.goto_assignments():
-                if assignment != result and assignment.module_path:
+            visited.add(self.get_position_key(result))
+            for assignment in result.goto_assignments():
+                if (assignment.module_path and
+                        self.get_position_key(assignment) not in visited):
                     result = assignment
                     break
             # Break out of while if no new result was found.
             else:
                 break
 
+        cache[key] = result
         return result
 
+    def get_position_key(self, definition):
+        return (definition.module_path, definition.line, definition.column)
+
     def get_definitions(self, script):
         results = []
         definitions = script.goto_assignments()
+        import_cache = {}
 
         for definition in definitions:
             if not definition.module_path:
                 continue
-            result = self.serialize_definition(self.follow_imports(definition))
+            result = self.serialize_definition(
+                self.follow_imports(definition, import_cache))
             results.append(result)
         return results
 
     def get_references(self, script):
         results = []
         references = script.usages()
+        # References within the same scope share a significant parent.
+        parent_cache = {}
 
         for ref in references:
             if not ref.module_path:
                 continue
             result = self.serialize_definition(ref)
-            parent = self.get_significant_parent(ref)
+            parent = self.get_significant_parent(ref, parent_cache)
             if parent is not None:
                 result['parentName'] = parent.name
             results.append(result)
@@ -192,22 +378,35 @@ class JediServer:
             'column': definition.column
         }
 
-    def get_significant_parent(self, definition):
+    def get_significant_parent(self, definition, cache):
         curr = definition.parent()
+        key = self.get_position_key(curr)
+        if key in cache:
+            return cache[key]
+
+        result = None
         while curr is not None:
-            if curr.type == 'function' or curr.type == 'class':
-                return curr
+            curr_type = curr.type
+            if curr_type == 'function' or curr_type == 'class':
+                result = curr
+                break
             # Since results are already grouped by module, there is no point in
             # returning a parent for a module-level reference.
-            elif curr.type == 'module':
-                return None
-            curr = definition.parent()
-        return None
+            elif curr_type == 'module':
+                break
+            curr = curr.parent()
+
+        cache[key] = result
+        return result
 
 
 if __name__ == '__main__':
     parser = OptionParser()
     parser.add_option('-s', '--source', dest='src', default='')
+    parser.add_option('--pypy', dest='pypy', action='store_true', default=False,
+                      help='Run the server under PyPy when it is installed.')
+    parser.add_option('--debug', dest='debug', action='store_true', default=False,
+                      help='Log at DEBUG level, including tracebacks of failed requests.')
     (opts, _) = parser.parse_args()
 
-    JediServer(opts.src).run()
+    JediServer(opts.src, opts.debug).run()
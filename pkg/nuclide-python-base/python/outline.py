@@ -8,7 +8,10 @@ import jedi
 
 
 def serialize_names(names):
-    return filter(None, [serialize_name(n) for n in names])
+    # Filter while serializing instead of building an intermediate list; on
+    # Python 3, filter() would also return an iterator json can't encode.
+    return [result for result in (serialize_name(n) for n in names)
+            if result is not None]
 
 
 def serialize_name(name):
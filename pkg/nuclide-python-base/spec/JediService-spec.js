@@ -11,7 +11,9 @@
 
 import invariant from 'assert';
 import fs from 'fs';
+import temp from 'temp';
 import nuclideUri from '../../nuclide-remote-uri';
+import {sleep} from '../../commons-node/promise';
 import {
   getCompletions,
   getDefinitions,
@@ -19,6 +21,8 @@ import {
   getOutline,
 } from '../lib/PythonService';
 
+temp.track();
+
 // Test python file located at fixtures/serverdummy.py
 const TEST_FILE = nuclideUri.join(__dirname, 'fixtures', 'serverdummy.py');
 const FILE_CONTENTS = fs.readFileSync(TEST_FILE).toString('utf8');
@@ -36,9 +40,9 @@ describe('PythonService', () => {
           // Fail - this line should not be reachable.
           invariant(false);
         } catch (e) {
-          // Python process should respond with a Traceback for what went wrong while
+          // Python process should respond with the exception raised while
           // processing the request.
-          expect(e.startsWith('Traceback')).toBeTruthy();
+          expect(e.startsWith('ValueError')).toBeTruthy();
         }
       });
     });
@@ -123,9 +127,9 @@ describe('PythonService', () => {
           // Fail - this line should not be reachable.
           invariant(false);
         } catch (e) {
-          // Python process should respond with a Traceback for what went wrong while
+          // Python process should respond with the exception raised while
           // processing the request.
-          expect(e.startsWith('Traceback')).toBeTruthy();
+          expect(e.startsWith('ValueError')).toBeTruthy();
         }
       });
     });
@@ -180,6 +184,41 @@ describe('PythonService', () => {
       });
     });
 
+    it('follows imports through multiple re-exports', () => {
+      waitsForPromise(async () => {
+        // line 29: c = Reexported()
+        const response = await getDefinitions(TEST_FILE, FILE_CONTENTS, 28, 7);
+        invariant(response);
+        expect(response.definitions.length).toBeGreaterThan(0);
+
+        const definition = response.definitions[0];
+        expect(definition.text).toEqual('Reexported');
+        expect(definition.type).toEqual('class');
+        // reexport.py re-exports from reexport_inner.py, which re-exports the
+        // class from reexport_source.py.
+        expect(definition.file.endsWith('reexport_source.py')).toBeTruthy();
+        expect(definition.line).toEqual(7);
+        expect(definition.column).toEqual(6);
+      });
+    });
+
+    it('stops following imports that form a cycle', () => {
+      waitsForPromise(async () => {
+        // line 31: d = Cycle()
+        const response = await getDefinitions(TEST_FILE, FILE_CONTENTS, 30, 7);
+        invariant(response);
+        expect(response.definitions.length).toBeGreaterThan(0);
+
+        // cycle_a.py and cycle_b.py import Cycle from each other, so the
+        // result is the last import statement before the cycle repeats.
+        const definition = response.definitions[0];
+        expect(definition.text).toEqual('Cycle');
+        expect(definition.type).toEqual('import');
+        expect(definition.file.endsWith('cycle_b.py')).toBeTruthy();
+        expect(definition.line).toEqual(6);
+      });
+    });
+
     it('can find the definitions of locally defined variables', () => {
       waitsForPromise(async () => {
         // line 15: potato3 = potato
@@ -195,6 +234,34 @@ describe('PythonService', () => {
         expect(definition.file).toEqual(TEST_FILE);
       });
     });
+
+    it('picks up changes to imported modules', () => {
+      waitsForPromise(async () => {
+        const tmpdir = temp.mkdirSync();
+        const mainFile = nuclideUri.join(tmpdir, 'main.py');
+        const importedFile = nuclideUri.join(tmpdir, 'b.py');
+        const mainContents = 'from b import foo\nfoo()\n';
+        fs.writeFileSync(mainFile, mainContents);
+        fs.writeFileSync(importedFile, 'def foo():\n    pass\n');
+
+        // line 2: foo()
+        let response = await getDefinitions(mainFile, mainContents, 1, 1);
+        invariant(response);
+        expect(response.definitions[0].file).toEqual(importedFile);
+        expect(response.definitions[0].line).toEqual(0);
+
+        // Move foo down in b.py, leaving the requesting buffer unchanged.
+        fs.writeFileSync(importedFile, '\n\n\n\ndef foo():\n    pass\n');
+        // Wait out the window in which jediserver.py reuses recent results;
+        // this must exceed RESULT_CACHE_VALIDITY (1 second) in jediserver.py.
+        await sleep(1100);
+
+        response = await getDefinitions(mainFile, mainContents, 1, 1);
+        invariant(response);
+        expect(response.definitions[0].file).toEqual(importedFile);
+        expect(response.definitions[0].line).toEqual(4);
+      });
+    });
   });
 
   describe('References', () => {
@@ -250,6 +317,37 @@ describe('PythonService', () => {
     });
   });
 
+  describe('References (nested scopes)', () => {
+    const NESTED_FILE = nuclideUri.join(__dirname, 'fixtures', 'nested_references.py');
+    const NESTED_CONTENTS = fs.readFileSync(NESTED_FILE).toString('utf8');
+
+    it('finds the enclosing function for references in nested lambdas', () => {
+      waitsForPromise(async () => {
+        // line 7: nested_name = 1
+        const response = await getReferences(NESTED_FILE, NESTED_CONTENTS, 6, 2);
+        invariant(response);
+
+        expect(response.references).toEqual([
+          {
+            type: 'statement',
+            text: 'nested_name',
+            file: NESTED_FILE,
+            line: 6,
+            column: 0,
+          },
+          {
+            type: 'lambda',
+            text: 'nested_name',
+            file: NESTED_FILE,
+            line: 10,
+            column: 29,
+            parentName: 'nested_fn',
+          },
+        ]);
+      });
+    });
+  });
+
   describe('Outlines', () => {
 
     function checkOutlineTree(testName: string) {
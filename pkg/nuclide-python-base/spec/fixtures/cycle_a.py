@@ -0,0 +1,8 @@
+# Copyright (c) 2015-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree.
+
+# Imports a name from cycle_b, which imports it back from here.
+from cycle_b import Cycle
@@ -0,0 +1,11 @@
+# Copyright (c) 2015-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree.
+
+nested_name = 1
+
+
+def nested_fn():
+    return (lambda: (lambda: nested_name)())()
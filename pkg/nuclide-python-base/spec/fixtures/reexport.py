@@ -0,0 +1,8 @@
+# Copyright (c) 2015-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree.
+
+# Re-exports a class that is itself re-exported by reexport_inner.
+from reexport_inner import Reexported
@@ -25,3 +25,7 @@ def test_fn():
 
 a = Tes
 b = Test2()
+from reexport import Reexported
+c = Reexported()
+from cycle_a import Cycle
+d = Cycle()